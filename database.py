@@ -5,11 +5,13 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError, OperationFailure
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
-from typing import Union
+from typing import List, Tuple, Union
 from pydantic import BaseModel
 
 # Load environment variables from .env file
@@ -21,35 +23,154 @@ db = None
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
+# Pool budget is shared by all uvicorn workers (each process has its own pool)
+_workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
 if database_url and database_name:
-    _client = MongoClient(database_url)
+    _client = AsyncIOMotorClient(
+        database_url,
+        maxPoolSize=max(10, 200 // _workers),
+        minPoolSize=max(1, 20 // _workers),
+        serverSelectionTimeoutMS=3000,
+        socketTimeoutMS=10000,
+        retryWrites=True,
+    )
     db = _client[database_name]
 
+async def ping_database():
+    """Round-trip to the server so the pool is warm before the first request"""
+    if _client is None:
+        return
+    await _client.admin.command("ping")
+
+# Set once the unique email index is known to exist on the server
+_email_index_ready = False
+# Set once ensure_indexes / ensure_views have completed
+_indexes_ready = False
+_views_ready = False
+
+def pending_bookings_view_ready() -> bool:
+    """Whether the pending_bookings view has been created"""
+    return _views_ready
+
+def schema_ready() -> bool:
+    """Whether startup index and view creation has completed"""
+    return db is None or (_indexes_ready and _views_ready)
+
+async def ensure_indexes():
+    """Create indexes backing the filters used by the list endpoints"""
+    global _email_index_ready, _indexes_ready
+    if db is None or _indexes_ready:
+        return
+    await db["user"].create_index("email", unique=True)
+    _email_index_ready = True
+    await db["user"].create_index([("role", 1), ("approved", 1)])
+    await db["section"].create_index("level_id")
+    await db["timetableentry"].create_index("section_id")
+    await db["announcement"].create_index([("audience", 1), ("level_id", 1), ("section_id", 1)])
+    await db["material"].create_index([("section_id", 1), ("teacher_id", 1)])
+    await db["roombooking"].create_index("status")
+    await db["attendance"].create_index([("section_id", 1), ("date", 1), ("student_id", 1)])
+    _indexes_ready = True
+
+async def email_index_ready() -> bool:
+    """Whether the unique email index exists; asks the server until it is confirmed"""
+    global _email_index_ready
+    if not _email_index_ready and db is not None:
+        info = await db["user"].index_information()
+        _email_index_ready = any(
+            spec.get("unique") and spec.get("key") == [("email", 1)] for spec in info.values()
+        )
+    return _email_index_ready
+
+async def ensure_views():
+    """Create read-only views for the most common fixed filters"""
+    global _views_ready
+    if db is None or _views_ready:
+        return
+    try:
+        await db.command("create", "pending_bookings", viewOn="roombooking", pipeline=[{"$match": {"status": "pending"}}])
+    except OperationFailure as e:
+        if e.code != 48:  # NamespaceExists: view already defined
+            raise
+    _views_ready = True
+
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
 
-    # Convert Pydantic model to dict if needed
+    # Convert Pydantic model to dict if needed; None fields are not stored
     if isinstance(data, BaseModel):
-        data_dict = data.model_dump()
+        data_dict = data.model_dump(exclude_none=True)
     else:
         data_dict = data.copy()
 
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
-    """Get documents from collection"""
+def _timestamped(items: List[Union[BaseModel, dict]]) -> List[dict]:
+    now = datetime.now(timezone.utc)
+    docs = []
+    for data in items:
+        data_dict = data.model_dump(exclude_none=True) if isinstance(data, BaseModel) else data.copy()
+        data_dict['created_at'] = now
+        data_dict['updated_at'] = now
+        docs.append(data_dict)
+    return docs
+
+async def create_documents(collection_name: str, items: List[Union[BaseModel, dict]]):
+    """Insert many documents with timestamps in a single round-trip"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+    if not items:
+        return []
+
+    result = await db[collection_name].insert_many(_timestamped(items))
+    return [str(_id) for _id in result.inserted_ids]
+
+async def create_documents_unordered(collection_name: str, items: List[Union[BaseModel, dict]]) -> Tuple[List[str], List[int]]:
+    """Insert many documents, continuing past failed rows; returns (inserted ids, failed indexes)"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+    if not items:
+        return [], []
+
+    docs = _timestamped(items)
+    try:
+        await db[collection_name].insert_many(docs, ordered=False)
+        failed = set()
+    except BulkWriteError as e:
+        failed = {err["index"] for err in e.details.get("writeErrors", [])}
+    # insert_many assigns _id to each document client-side, so successful
+    # rows can be reported even when the batch partially failed
+    ids = [str(doc["_id"]) for i, doc in enumerate(docs) if i not in failed]
+    return ids, sorted(failed)
+
+async def get_documents(collection_name: str, filter_dict: dict = None, projection: dict = None, skip: int = 0, limit: int = None):
+    """Get documents from collection, optionally projected and paginated"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
     
-    cursor = db[collection_name].find(filter_dict or {})
+    cursor = db[collection_name].find(filter_dict or {}, projection)
+    if skip or limit:
+        # stable order so consecutive pages neither repeat nor drop rows
+        cursor = cursor.sort("_id", 1)
+    if skip:
+        cursor = cursor.skip(skip)
     if limit:
         cursor = cursor.limit(limit)
     
-    return list(cursor)
+    return await cursor.to_list(length=None)
+
+async def get_existing_ids(collection_name: str, ids: List[ObjectId]) -> set:
+    """Return the subset of ids present in a collection, using one $in query"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    cursor = db[collection_name].find({"_id": {"$in": list(set(ids))}}, {"_id": 1})
+    return {doc["_id"] for doc in await cursor.to_list(length=None)}
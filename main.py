@@ -1,29 +1,140 @@
+import asyncio
+import logging
 import os
-from fastapi import FastAPI, HTTPException, status
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from fastapi import FastAPI, HTTPException, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi import Body, Query
+from fastapi.encoders import ENCODERS_BY_TYPE, jsonable_encoder
 from typing import List, Optional
+import orjson
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import DuplicateKeyError
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from fastapi_cache.backends.redis import RedisBackend
+from fastapi_cache.coder import Coder
+from fastapi_cache.decorator import cache
+from redis import asyncio as aioredis
 
-from database import db, create_document, get_documents
-from schemas import User, Level, Section, TimetableEntry, Announcement, Material, RoomBooking, Attendance, IDResponse
+from database import db, ping_database, schema_ready, pending_bookings_view_ready, ensure_indexes, email_index_ready, ensure_views, create_document, create_documents, create_documents_unordered, get_documents, get_existing_ids
+from schemas import User, Level, Section, TimetableEntry, Announcement, Material, RoomBooking, StatusBody, Attendance, IDResponse, BulkInsertResponse
 
-app = FastAPI(title="EE Department Management API")
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Response cache for read-heavy, rarely-changing endpoints.  It must be
+    # shared across workers for invalidation to work, so without Redis @cache
+    # is a pass-through (the in-memory backend only backs the no-op clears).
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        FastAPICache.init(RedisBackend(aioredis.from_url(redis_url)), prefix="eedept", coder=JsonableCoder)
+    else:
+        FastAPICache.init(InMemoryBackend(), prefix="eedept", enable=False)
+    # If Mongo is unreachable keep serving so /health and /test can report it;
+    # index/view setup is retried after later requests (see retry_schema_setup).
+    try:
+        await ping_database()
+    except Exception:
+        logger.warning("Database ping failed at startup", exc_info=True)
+    await _ensure_schema()
+    yield
+
+async def _ensure_schema():
+    for step in (ensure_indexes, ensure_views):
+        try:
+            await step()
+        except Exception:
+            logger.warning("%s failed; will retry", step.__name__, exc_info=True)
+
+# FastAPI passes return values through jsonable_encoder before render(), and
+# that raises on ObjectId, so teach it to emit the hex string.
+ENCODERS_BY_TYPE[ObjectId] = str
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered by orjson (default=str only catches types the encoder left unconverted)"""
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+class JsonableCoder(Coder):
+    """Caches the jsonable_encoder output, so a hit returns exactly what a miss sent"""
+    @classmethod
+    def encode(cls, value) -> bytes:
+        return orjson.dumps(jsonable_encoder(value), option=orjson.OPT_NON_STR_KEYS)
+
+    @classmethod
+    def decode(cls, value: bytes):
+        return orjson.loads(value)
+
+app = FastAPI(title="EE Department Management API", lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# Explicit origins (comma-separated in CORS_ORIGINS) so credentials are valid
+# and browsers can cache preflight responses.
+_cors_origins = os.getenv("CORS_ORIGINS", "https://admin.eedept.example,https://app.eedept.example")
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=[o.strip() for o in _cors_origins.split(",") if o.strip()],
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "PATCH"],
+    allow_headers=["Authorization", "Content-Type"],
+    max_age=86400,
 )
 
+@app.middleware("http")
+async def revalidate_cached_responses(request, call_next):
+    # fastapi-cache sends Cache-Control: max-age=<expire>, which would let
+    # browsers keep lists past a server-side clear; make them revalidate via ETag.
+    response = await call_next(request)
+    if "x-fastapi-cache" in response.headers:
+        response.headers["Cache-Control"] = "no-cache"
+    return response
+
+# Background retry of index/view creation after a successful request,
+# at most once per interval, while startup setup is still incomplete.
+_SCHEMA_RETRY_INTERVAL = 30.0
+_schema_retry = {"at": 0.0, "task": None}
+
+@app.middleware("http")
+async def retry_schema_setup(request, call_next):
+    response = await call_next(request)
+    now = time.monotonic()
+    task = _schema_retry["task"]
+    if (not schema_ready() and response.status_code < 500 and now >= _schema_retry["at"]
+            and (task is None or task.done())):
+        _schema_retry["at"] = now + _SCHEMA_RETRY_INTERVAL
+        _schema_retry["task"] = asyncio.create_task(_ensure_schema())
+    return response
+
 @app.get("/")
 def read_root():
     return {"message": "EE Department Backend Running"}
 
+@app.get("/health")
+def health():
+    # Liveness probe: no database round-trip
+    return {"backend": "ok", "database": "configured" if db is not None else "not configured"}
+
+# Collection listing walks the catalog; reuse it for a short while
+_COLLECTIONS_TTL = 30.0
+_collections_cache = (0.0, None)
+
+async def _collection_names() -> list:
+    global _collections_cache
+    fetched_at, names = _collections_cache
+    now = time.monotonic()
+    if names is None or now - fetched_at > _COLLECTIONS_TTL:
+        names = await db.list_collection_names()
+        _collections_cache = (now, names)
+    return names
+
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -39,7 +150,7 @@ def test_database():
             response["database_name"] = db.name
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = await _collection_names()
                 response["collections"] = collections[:15]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -52,35 +163,69 @@ def test_database():
 
 # Helpers
 
+@lru_cache(maxsize=4096)
+def _oid_cached(id_str: str) -> ObjectId:
+    return ObjectId(id_str)
+
 def _oid(id_str: str) -> ObjectId:
     try:
-        return ObjectId(id_str)
-    except Exception:
+        return _oid_cached(id_str)
+    except (InvalidId, TypeError):
         raise HTTPException(status_code=400, detail="Invalid id")
 
+def _ref(id_str: str) -> dict:
+    # References were stored as hex strings before they became ObjectIds;
+    # match both forms so older documents keep showing up.
+    oid = _oid(id_str)
+    return {"$in": [oid, str(oid)]}
+
+async def _invalidate(namespace: str):
+    # Runs after the write has committed; a cache outage must not turn that
+    # into a 500 (clients would retry and duplicate the write).
+    try:
+        await FastAPICache.clear(namespace=namespace)
+    except Exception:
+        logger.warning("Cache invalidation failed for %s", namespace, exc_info=True)
+
+async def _bulk_insert_with_parent(collection_name: str, items: list, parent_collection: str, parent_field: str) -> dict:
+    """Insert rows whose parent reference exists; report indexes of the rest"""
+    if not items:
+        return {"ids": [], "rejected": []}
+    found = await get_existing_ids(parent_collection, [getattr(item, parent_field) for item in items])
+    valid, rejected = [], []
+    for i, item in enumerate(items):
+        if getattr(item, parent_field) in found:
+            valid.append(item)
+        else:
+            rejected.append(i)
+    return {"ids": await create_documents(collection_name, valid), "rejected": rejected}
+
 # Admin endpoints
 
 @app.post("/auth/register", response_model=IDResponse)
 async def register_user(user: User):
-    # Ensure unique email
-    if db["user"].find_one({"email": user.email}):
+    # Uniqueness is enforced by the unique index on email (see ensure_indexes);
+    # until that index is confirmed, fall back to checking first.
+    if not await email_index_ready() and await db["user"].find_one({"email": user.email}, {"_id": 1}):
+        raise HTTPException(status_code=400, detail="Email already registered")
+    try:
+        inserted_id = await create_document("user", user)
+    except DuplicateKeyError:
         raise HTTPException(status_code=400, detail="Email already registered")
-    user_dict = user.model_dump()
-    inserted_id = create_document("user", user_dict)
     return {"id": inserted_id}
 
-@app.get("/users", response_model=List[dict])
-async def list_users(role: Optional[str] = Query(None), approved: Optional[bool] = Query(None)):
+@app.get("/users")
+async def list_users(role: Optional[str] = Query(None), approved: Optional[bool] = Query(None), skip: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=500)):
     filt = {}
     if role:
         filt["role"] = role
     if approved is not None:
         filt["approved"] = approved
-    return get_documents("user", filt)
+    return await get_documents("user", filt, projection={"password": 0}, skip=skip, limit=limit)
 
 @app.patch("/users/{user_id}/approve")
 async def approve_user(user_id: str, approved: bool = Body(True)):
-    res = db["user"].update_one({"_id": _oid(user_id)}, {"$set": {"approved": approved}})
+    res = await db["user"].update_one({"_id": _oid(user_id)}, {"$set": {"approved": approved}})
     if res.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     return {"status": "ok"}
@@ -88,30 +233,43 @@ async def approve_user(user_id: str, approved: bool = Body(True)):
 # Levels & Sections
 @app.post("/levels", response_model=IDResponse)
 async def create_level(level: Level):
-    return {"id": create_document("level", level)}
+    inserted_id = await create_document("level", level)
+    await _invalidate("levels")
+    return {"id": inserted_id}
 
 @app.get("/levels")
+@cache(expire=300, namespace="levels")
 async def list_levels():
-    return get_documents("level")
+    return await get_documents("level")
 
 @app.post("/sections", response_model=IDResponse)
 async def create_section(section: Section):
     # ensure level exists
-    if not db["level"].find_one({"_id": _oid(section.level_id)}):
+    if not await db["level"].find_one({"_id": section.level_id}):
         raise HTTPException(status_code=400, detail="Level not found")
-    return {"id": create_document("section", section)}
+    inserted_id = await create_document("section", section)
+    await _invalidate("sections")
+    return {"id": inserted_id}
+
+@app.post("/sections/bulk", response_model=BulkInsertResponse)
+async def create_sections_bulk(sections: List[Section]):
+    result = await _bulk_insert_with_parent("section", sections, "level", "level_id")
+    await _invalidate("sections")
+    return result
 
 @app.get("/sections")
+@cache(expire=300, namespace="sections")
 async def list_sections(level_id: Optional[str] = Query(None)):
-    filt = {"level_id": level_id} if level_id else {}
-    return get_documents("section", filt)
+    filt = {"level_id": _ref(level_id)} if level_id else {}
+    return await get_documents("section", filt)
 
 # Assign student to section
 @app.patch("/users/{user_id}/section")
 async def assign_section(user_id: str, section_id: str = Body(..., embed=True)):
-    if not db["section"].find_one({"_id": _oid(section_id)}):
+    section_oid = _oid(section_id)
+    if not await db["section"].find_one({"_id": section_oid}):
         raise HTTPException(status_code=400, detail="Section not found")
-    res = db["user"].update_one({"_id": _oid(user_id)}, {"$set": {"section_id": section_id}})
+    res = await db["user"].update_one({"_id": _oid(user_id)}, {"$set": {"section_id": section_oid}})
     if res.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     return {"status": "ok"}
@@ -120,88 +278,132 @@ async def assign_section(user_id: str, section_id: str = Body(..., embed=True)):
 @app.post("/timetable", response_model=IDResponse)
 async def add_timetable(entry: TimetableEntry):
     # Validate section
-    if not db["section"].find_one({"_id": _oid(entry.section_id)}):
+    if not await db["section"].find_one({"_id": entry.section_id}):
         raise HTTPException(status_code=400, detail="Section not found")
-    return {"id": create_document("timetableentry", entry)}
+    inserted_id = await create_document("timetableentry", entry)
+    await _invalidate("timetable")
+    return {"id": inserted_id}
+
+@app.post("/timetable/bulk", response_model=BulkInsertResponse)
+async def add_timetable_bulk(entries: List[TimetableEntry]):
+    result = await _bulk_insert_with_parent("timetableentry", entries, "section", "section_id")
+    await _invalidate("timetable")
+    return result
 
 @app.get("/timetable")
+@cache(expire=600, namespace="timetable")
 async def get_timetable(section_id: str):
-    return get_documents("timetableentry", {"section_id": section_id})
+    return await get_documents("timetableentry", {"section_id": _ref(section_id)})
 
 # Announcements
 @app.post("/announcements", response_model=IDResponse)
 async def create_announcement(ann: Announcement):
-    return {"id": create_document("announcement", ann)}
+    inserted_id = await create_document("announcement", ann)
+    await _invalidate("announcements")
+    return {"id": inserted_id}
 
 @app.get("/announcements")
-async def list_announcements(audience: Optional[str] = Query(None), level_id: Optional[str] = Query(None), section_id: Optional[str] = Query(None)):
+@cache(expire=60, namespace="announcements")
+async def list_announcements(audience: Optional[str] = Query(None), level_id: Optional[str] = Query(None), section_id: Optional[str] = Query(None), summary: bool = Query(False), skip: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=500)):
     filt = {}
     if audience: filt["audience"] = audience
-    if level_id: filt["level_id"] = level_id
-    if section_id: filt["section_id"] = section_id
-    return get_documents("announcement", filt)
+    if level_id: filt["level_id"] = _ref(level_id)
+    if section_id: filt["section_id"] = _ref(section_id)
+    projection = {"body": 0} if summary else None
+    return await get_documents("announcement", filt, projection=projection, skip=skip, limit=limit)
 
 # Materials
 @app.post("/materials", response_model=IDResponse)
 async def upload_material(mat: Material):
     # For MVP: we store a URL to a file (pdf/image)
-    return {"id": create_document("material", mat)}
+    return {"id": await create_document("material", mat)}
 
 @app.get("/materials")
 async def list_materials(section_id: Optional[str] = Query(None), teacher_id: Optional[str] = Query(None)):
     filt = {}
-    if section_id: filt["section_id"] = section_id
-    if teacher_id: filt["teacher_id"] = teacher_id
-    return get_documents("material", filt)
+    if section_id: filt["section_id"] = _ref(section_id)
+    if teacher_id: filt["teacher_id"] = _ref(teacher_id)
+    return await get_documents("material", filt)
 
 # Room booking
 @app.post("/bookings", response_model=IDResponse)
 async def request_booking(rb: RoomBooking):
-    return {"id": create_document("roombooking", rb)}
+    return {"id": await create_document("roombooking", rb)}
 
 @app.patch("/bookings/{booking_id}/status")
-async def set_booking_status(booking_id: str, status_value: str = Body(..., embed=True)):
-    if status_value not in ["pending", "approved", "declined"]:
-        raise HTTPException(status_code=400, detail="Invalid status")
-    res = db["roombooking"].update_one({"_id": _oid(booking_id)}, {"$set": {"status": status_value}})
+async def set_booking_status(booking_id: str, body: StatusBody):
+    res = await db["roombooking"].update_one({"_id": _oid(booking_id)}, {"$set": {"status": body.status_value}})
     if res.matched_count == 0:
         raise HTTPException(status_code=404, detail="Booking not found")
     return {"status": "ok"}
 
 @app.get("/bookings")
 async def list_bookings(status: Optional[str] = Query(None)):
+    # A missing view reads as an empty collection, so only use it once created
+    if status == "pending" and pending_bookings_view_ready():
+        return await get_documents("pending_bookings")
     filt = {"status": status} if status else {}
-    return get_documents("roombooking", filt)
+    return await get_documents("roombooking", filt)
 
 # Attendance
 @app.post("/attendance", response_model=IDResponse)
 async def mark_attendance(a: Attendance):
     # basic presence record
-    return {"id": create_document("attendance", a)}
+    return {"id": await create_document("attendance", a)}
 
-@app.get("/attendance")
-async def list_attendance(section_id: Optional[str] = Query(None), student_id: Optional[str] = Query(None), date: Optional[str] = Query(None)):
+@app.post("/attendance/bulk", response_model=BulkInsertResponse)
+async def mark_attendance_bulk(items: List[Attendance]):
+    # whole roll-call in one insert_many; unordered keeps going past a failed
+    # row, which is reported back in "rejected"
+    ids, rejected = await create_documents_unordered("attendance", items)
+    return {"ids": ids, "rejected": rejected}
+
+def _attendance_filter(section_id: Optional[str], student_id: Optional[str], date: Optional[str]) -> dict:
     filt = {}
-    if section_id: filt["section_id"] = section_id
-    if student_id: filt["student_id"] = student_id
+    if section_id: filt["section_id"] = _ref(section_id)
+    if student_id: filt["student_id"] = _ref(student_id)
     if date: filt["date"] = date
-    return get_documents("attendance", filt)
+    return filt
+
+@app.get("/attendance")
+async def list_attendance(section_id: Optional[str] = Query(None), student_id: Optional[str] = Query(None), date: Optional[str] = Query(None)):
+    return await get_documents("attendance", _attendance_filter(section_id, student_id, date))
+
+@app.get("/attendance/stream")
+async def list_attendance_stream(section_id: Optional[str] = Query(None), student_id: Optional[str] = Query(None), date: Optional[str] = Query(None)):
+    # NDJSON, one record per line, read straight off the cursor
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database not available")
+    filt = _attendance_filter(section_id, student_id, date)
+
+    async def rows():
+        async for doc in db["attendance"].find(filt):
+            yield orjson.dumps(doc, default=str) + b"\n"
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
 
 # Schema exposure for the database viewer (optional utility)
+# Model schemas are immutable for the process lifetime, so build them once.
+_SCHEMA_CACHE = {
+    "user": User.model_json_schema(),
+    "level": Level.model_json_schema(),
+    "section": Section.model_json_schema(),
+    "timetableentry": TimetableEntry.model_json_schema(),
+    "announcement": Announcement.model_json_schema(),
+    "material": Material.model_json_schema(),
+    "roombooking": RoomBooking.model_json_schema(),
+    "attendance": Attendance.model_json_schema(),
+}
+
 @app.get("/schema")
-async def get_schema_definitions():
-    return {
-        "user": User.model_json_schema(),
-        "level": Level.model_json_schema(),
-        "section": Section.model_json_schema(),
-        "timetableentry": TimetableEntry.model_json_schema(),
-        "announcement": Announcement.model_json_schema(),
-        "material": Material.model_json_schema(),
-        "roombooking": RoomBooking.model_json_schema(),
-        "attendance": Attendance.model_json_schema(),
-    }
+async def get_schema_definitions(response: Response):
+    response.headers["Cache-Control"] = "public, max-age=3600"
+    return _SCHEMA_CACHE
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Capped by default; workers read WEB_CONCURRENCY to size their Mongo pool
+    workers = int(os.getenv("WEB_CONCURRENCY", min(os.cpu_count() or 2, 4)))
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    uvicorn.run("main:app", host="0.0.0.0", port=port, loop="uvloop", http="httptools", workers=workers)
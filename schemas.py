@@ -3,10 +3,26 @@ Database Schemas for Electrical Engineering Department Management
 
 Each Pydantic model maps to a MongoDB collection (lowercased class name).
 """
-from typing import Optional, List, Literal
-from pydantic import BaseModel, Field
+from typing import Annotated, Optional, List, Literal
+from bson import ObjectId
+from pydantic import BaseModel, ConfigDict, Field, PlainSerializer, PlainValidator, WithJsonSchema
 from datetime import datetime
 
+def _to_object_id(value) -> ObjectId:
+    if isinstance(value, ObjectId):
+        return value
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    raise ValueError("Invalid id")
+
+# Reference to another document's _id: accepted as a hex string, stored as ObjectId
+PyObjectId = Annotated[
+    ObjectId,
+    PlainValidator(_to_object_id),
+    PlainSerializer(str, return_type=str, when_used="json"),
+    WithJsonSchema({"type": "string", "pattern": "^[0-9a-fA-F]{24}$"}),
+]
+
 # Core user schema
 class User(BaseModel):
     full_name: str = Field(..., description="Full name")
@@ -14,7 +30,7 @@ class User(BaseModel):
     password: str = Field(..., description="Hashed password or placeholder for MVP")
     role: Literal["admin", "teacher", "student"] = Field(..., description="User role")
     approved: bool = Field(False, description="Whether the account is approved by admins")
-    section_id: Optional[str] = Field(None, description="For students: section they belong to")
+    section_id: Optional[PyObjectId] = Field(None, description="For students: section they belong to")
 
 # Academic level (e.g., 1ere annee licence, 2eme annee, Master, etc.)
 class Level(BaseModel):
@@ -23,33 +39,33 @@ class Level(BaseModel):
 
 # Section inside a level (e.g., A, B, C)
 class Section(BaseModel):
-    level_id: str = Field(..., description="Reference to level _id as string")
+    level_id: PyObjectId = Field(..., description="Reference to level _id")
     name: str = Field(..., description="Section name, e.g., A, B, C")
 
 # Timetable entry for a section
 class TimetableEntry(BaseModel):
-    section_id: str = Field(..., description="Section id")
+    section_id: PyObjectId = Field(..., description="Section id")
     day: Literal["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
     start_time: str = Field(..., description="Start time HH:MM")
     end_time: str = Field(..., description="End time HH:MM")
     room: str = Field(..., description="Room name/number")
     subject: str = Field(..., description="Course/subject name")
-    teacher_id: Optional[str] = Field(None, description="Teacher responsible")
+    teacher_id: Optional[PyObjectId] = Field(None, description="Teacher responsible")
 
 # Announcement/Notification
 class Announcement(BaseModel):
     title: str
     body: str
-    author_id: Optional[str] = None
+    author_id: Optional[PyObjectId] = None
     audience: Literal["all", "admins", "teachers", "students", "level", "section"] = "all"
-    level_id: Optional[str] = None
-    section_id: Optional[str] = None
+    level_id: Optional[PyObjectId] = None
+    section_id: Optional[PyObjectId] = None
     pinned: bool = False
 
 # Teacher material (link-based for MVP)
 class Material(BaseModel):
-    teacher_id: str
-    section_id: Optional[str] = None
+    teacher_id: PyObjectId
+    section_id: Optional[PyObjectId] = None
     title: str
     url: str = Field(..., description="Public URL to PDF/image/drive link")
     description: Optional[str] = None
@@ -61,21 +77,32 @@ class RoomBooking(BaseModel):
     start_time: str
     end_time: str
     purpose: Optional[str] = None
-    requested_by: str = Field(..., description="Teacher user id")
+    requested_by: PyObjectId = Field(..., description="Teacher user id")
     status: Literal["pending", "approved", "declined"] = "pending"
 
+# Body for PATCH /bookings/{id}/status
+class StatusBody(BaseModel):
+    status_value: Literal["pending", "approved", "declined"]
+
 # Attendance record
 class Attendance(BaseModel):
-    section_id: str
-    timetable_id: Optional[str] = None
+    # Hot path: reject unknown keys outright; records are immutable once built
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
+    section_id: PyObjectId
+    timetable_id: Optional[PyObjectId] = None
     date: str = Field(..., description="YYYY-MM-DD")
-    student_id: str
+    student_id: PyObjectId
     present: bool = True
 
 # Utility response models (optional minimal)
 class IDResponse(BaseModel):
     id: str
 
+class BulkInsertResponse(BaseModel):
+    ids: List[str]
+    rejected: List[int] = Field(default_factory=list, description="Indexes of payload rows that were not inserted")
+
 class Paginated(BaseModel):
     total: int
     items: list